@@ -1,80 +1,301 @@
+import io
 import os
+import queue
+import shutil
+import socket
+import threading
 import time
 import requests
-import json
+import orjson
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
 # Configuración inicial
 SOURCE_SPACE = 'littletest/Why'  # Espacio de origen
 TEMP_DOWNLOAD_DIR = './temp_downloads'
-TIMEOUT_BETWEEN_UPLOADS = 5  # Tiempo de espera en segundos (fijo)
+SHM_DOWNLOAD_DIR = '/dev/shm/hf2gofile'  # Directorio en RAM (tmpfs) para archivos que quepan
+SHM_RESERVE = 512 << 20  # Espacio que se deja siempre libre en /dev/shm (512 MiB)
+# Subir desde la descarga, sin pasar por disco, si se conoce el tamaño. Mientras esté
+# activo, download_file solo recibe archivos de tamaño desconocido, así que /dev/shm
+# y la reserva con posix_fallocate solo se usan con STREAM_UPLOADS = False
+STREAM_UPLOADS = True
+IGNORED_SUFFIXES = ('.gitattributes',)  # Archivos del Space que no se transfieren
+UPLOADS_INFO_FILE = 'uploads_info.jsonl'  # Una línea JSON por cada subida exitosa
+HF_CACHE_FILE = 'hf_cache.json'  # ETag y lista de archivos de cada Space consultado
+DOWNLOAD_WORKERS = 4  # Descargas simultáneas
+UPLOAD_WORKERS = 4  # Subidas simultáneas
+PIPELINE_QUEUE_SIZE = 2  # Archivos descargados que pueden esperar a ser subidos
+SERVER_CACHE_TTL = 300  # Segundos que se reutiliza el servidor de Gofile elegido
+SERVER_LOOKUP_TIMEOUT = 10  # Segundos máximos para consultar los servidores de Gofile
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # Tamaño de bloque para descargas (1 MiB)
+UPLOAD_BLOCK_SIZE = 1 << 20  # Tamaño de bloque al enviar el cuerpo de las subidas (1 MiB)
+
+# Cabeceras para simular un navegador en las peticiones a Gofile
+GOFILE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.121 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Origin': 'https://gofile.io',
+    'Referer': 'https://gofile.io/',
+}
 
 # Lista para almacenar información de las subidas exitosas
 successful_uploads = []
+uploads_lock = threading.Lock()  # Protege successful_uploads y UPLOADS_INFO_FILE
+_uploads_log = None  # Se abre en modo append (binario) con la primera subida
+
+# Último servidor de Gofile elegido y momento en que caduca
+_server_cache = {'name': None, 'expires': 0.0}
+server_cache_lock = threading.Lock()
+
+class BulkTransferAdapter(HTTPAdapter):
+    """
+    Adaptador HTTP para transferencias grandes: envía los cuerpos en bloques grandes
+    (urllib3 usa 16 KiB por defecto) y mantiene vivas las conexiones TCP inactivas
+    """
+    # Los búferes del socket se dejan al autoajuste del kernel: fijarlos lo desactiva
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('blocksize', UPLOAD_BLOCK_SIZE)
+        kwargs.setdefault('socket_options', self.socket_options)
+        super().init_poolmanager(*args, **kwargs)
+
+def create_session(headers=None):
+    """
+    Crear una sesión HTTP que reutiliza conexiones y reintenta errores temporales
+    
+    :param headers: Cabeceras por defecto de la sesión
+    :return: Sesión de requests configurada
+    """
+    session = requests.Session()
+    adapter = BulkTransferAdapter(
+        pool_connections=8,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+# Sesiones compartidas (una por servicio) para reutilizar conexiones keep-alive
+HF_SESSION = create_session()
+GOFILE_SESSION = create_session(GOFILE_HEADERS)
+
+class RemoteFile:
+    """
+    Archivo de un espacio de Hugging Face leído directamente de la descarga, con la
+    interfaz (read, seek y len) que MultipartEncoder necesita para subirlo a Gofile
+    """
+    def __init__(self, url):
+        self.url = url
+        self.response = None
+        self._open()
+    
+    def _open(self):
+        if self.response is not None:
+            self.response.close()
+        self.response = HF_SESSION.get(self.url, stream=True)
+        self.response.raise_for_status()
+        self.position = 0
+        
+        # Tamaño final del archivo (Content-Length solo coincide si no viene comprimido)
+        self.size = 0
+        if 'Content-Encoding' not in self.response.headers:
+            self.size = int(self.response.headers.get('Content-Length', 0))
+        
+        # Descomprimir el cuerpo igual que iter_content
+        self.response.raw.decode_content = True
+    
+    @property
+    def len(self):
+        """Bytes que quedan por leer (MultipartEncoder lo consulta durante el envío)"""
+        return max(self.size - self.position, 0)
+    
+    def read(self, size=-1):
+        chunk = self.response.raw.read(size if size >= 0 else None) or b''
+        self.position += len(chunk)
+        return chunk
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Volver al principio, pidiendo de nuevo la descarga si ya se empezó a leer"""
+        if offset or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('RemoteFile solo puede volver al principio')
+        if self.position:
+            self._open()
+        return 0
+    
+    def close(self):
+        self.response.close()
+
+def load_hf_cache():
+    """
+    Leer la caché de listados de Spaces guardada en HF_CACHE_FILE
+    
+    :return: Diccionario {espacio: {'etag': ..., 'siblings': [...]}} (vacío si no hay caché)
+    """
+    try:
+        with open(HF_CACHE_FILE, 'rb') as f:
+            cache = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    # Un archivo con otra estructura se trata igual que si no hubiera caché
+    return cache if isinstance(cache, dict) else {}
+
+def save_hf_cache(cache):
+    """
+    Guardar la caché de listados de Spaces en HF_CACHE_FILE
+    
+    :param cache: Diccionario {espacio: {'etag': ..., 'siblings': [...]}}
+    """
+    try:
+        with open(HF_CACHE_FILE, 'wb') as f:
+            f.write(orjson.dumps(cache))
+    except OSError as e:
+        print(f'Error al guardar la caché de archivos: {e}')
 
 def get_file_list(space_name):
     """
     Obtener la lista de archivos desde un espacio de Hugging Face
+    (con petición condicional: si el Space no ha cambiado se usa la lista en caché)
     
     :param space_name: Nombre del espacio
     :return: Lista de archivos
     """
     url = f'https://huggingface.co/api/spaces/{space_name}'
+    cache = load_hf_cache()
+    cached = cache.get(space_name)
+    # Solo se usa una entrada completa; si no, se pide el listado sin condiciones
+    if not (isinstance(cached, dict) and isinstance(cached.get('etag'), str)
+            and isinstance(cached.get('siblings'), list)):
+        cached = None
+    headers = {'If-None-Match': cached['etag']} if cached else {}
     try:
-        response = requests.get(url)
+        response = HF_SESSION.get(url, headers=headers)
         
-        if response.status_code == 200:
-            data = response.json()
-            # Filtrar archivos, excluyendo .gitattributes
-            return [file['rfilename'] for file in data['siblings'] if not file['rfilename'].endswith('.gitattributes')]
+        if response.status_code == 304 and cached:
+            print('El Space no ha cambiado, usando la lista de archivos en caché')
+            siblings = cached['siblings']
+        elif response.status_code == 200:
+            data = orjson.loads(response.content)
+            siblings = [file['rfilename'] for file in data['siblings']]
+            
+            # Recordar el listado para la próxima ejecución
+            etag = response.headers.get('ETag')
+            if etag:
+                cache[space_name] = {'etag': etag, 'siblings': siblings}
+                save_hf_cache(cache)
         else:
             print(f'Error al obtener archivos: {response.status_code}')
             return []
+        
+        # Filtrar archivos, excluyendo los terminados en IGNORED_SUFFIXES
+        return [name for name in siblings if not name.endswith(IGNORED_SUFFIXES)]
     except Exception as e:
         print(f'Error al obtener lista de archivos: {e}')
         return []
 
-def download_file(space_name, file_path):
+def get_download_dir(size):
     """
-    Descargar un archivo de un espacio de Hugging Face
+    Elegir dónde guardar una descarga: en RAM si cabe, en disco si no
     
-    :param space_name: Nombre del espacio
-    :param file_path: Ruta del archivo
-    :return: Ruta local del archivo descargado o None si falla
+    :param size: Tamaño esperado del archivo en bytes (0 si se desconoce)
+    :return: SHM_DOWNLOAD_DIR o TEMP_DOWNLOAD_DIR
     """
-    # Crear directorio de descargas si no existe
-    os.makedirs(TEMP_DOWNLOAD_DIR, exist_ok=True)
+    if size > 0:
+        try:
+            if shutil.disk_usage('/dev/shm').free > size + SHM_RESERVE:
+                return SHM_DOWNLOAD_DIR
+        except OSError:
+            pass  # Sin /dev/shm (no es Linux o no está montado)
+    return TEMP_DOWNLOAD_DIR
+
+def create_local_file(download_dir, file_path, size):
+    """
+    Crear el archivo local de una descarga con todo su espacio reservado
     
-    # URL de descarga
-    download_url = f'https://huggingface.co/spaces/{space_name}/resolve/main/{file_path}?download=true'
+    :param download_dir: Directorio donde crear el archivo
+    :param file_path: Ruta del archivo en el Space
+    :param size: Tamaño esperado del archivo en bytes (0 si se desconoce)
+    :return: Tupla (ruta local, archivo abierto para escritura)
+    """
+    # Ruta local para guardar el archivo (se conserva la ruta relativa para
+    # que dos descargas simultáneas con el mismo nombre no se pisen)
+    local_filename = os.path.join(download_dir, file_path)
+    os.makedirs(os.path.dirname(local_filename), exist_ok=True)
     
+    f = open(local_filename, 'wb')
     try:
-        # Descargar el archivo
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()
-        
-        # Ruta local para guardar el archivo
-        local_filename = os.path.join(TEMP_DOWNLOAD_DIR, os.path.basename(file_path))
+        # Reservar todo el espacio de una vez para evitar un archivo fragmentado
+        if size > 0 and hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:
+        f.close()
+        os.remove(local_filename)
+        raise
+    return local_filename, f
+
+def download_file(remote, file_path):
+    """
+    Guardar en un archivo local una descarga de un espacio de Hugging Face
+    
+    :param remote: Descarga abierta (RemoteFile)
+    :param file_path: Ruta del archivo en el Space
+    :return: Ruta local del archivo descargado o None si falla
+    """
+    local_filename = None
+    try:
+        download_dir = get_download_dir(remote.size)
+        try:
+            local_filename, f = create_local_file(download_dir, file_path, remote.size)
+        except OSError as e:
+            # Otra descarga simultánea pudo ocupar /dev/shm entre la comprobación y la reserva
+            if download_dir != SHM_DOWNLOAD_DIR:
+                raise
+            print(f'Sin espacio en {SHM_DOWNLOAD_DIR} ({e}), descargando en {TEMP_DOWNLOAD_DIR}')
+            local_filename, f = create_local_file(TEMP_DOWNLOAD_DIR, file_path, remote.size)
         
-        with open(local_filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        # Copiar el cuerpo directamente del socket al archivo por bloques grandes
+        # (no se usa readinto con un búfer reutilizado: el de urllib3 llama a read()
+        # y copia el resultado, así que añadiría una copia sin ahorrar asignaciones)
+        with f:
+            shutil.copyfileobj(remote, f, length=DOWNLOAD_CHUNK_SIZE)
+            # Quitar el espacio reservado que no se haya llegado a escribir
+            f.truncate()
         
         print(f'Descargado: {local_filename}')
         return local_filename
     except Exception as e:
         print(f'Error al descargar el archivo {file_path}: {e}')
+        # No dejar archivos a medias (en /dev/shm ocupan memoria)
+        if local_filename:
+            cleanup(local_filename)
         return None
 
 def get_best_server():
     """
     Obtiene el mejor servidor de Gofile para subir archivos
+    (el resultado se reutiliza durante SERVER_CACHE_TTL segundos)
     
     :return: Mejor servidor o None si falla
     """
+    # Reutilizar el servidor elegido si no ha caducado
+    with server_cache_lock:
+        if time.time() < _server_cache['expires']:
+            return _server_cache['name']
+    
     try:
-        response = requests.get('https://api.gofile.io/servers')
+        # La consulta se hace fuera del bloqueo para que una petición lenta
+        # no detenga al resto de subidas
+        response = GOFILE_SESSION.get('https://api.gofile.io/servers', timeout=SERVER_LOOKUP_TIMEOUT)
         response.raise_for_status()
-        result = response.json()
+        result = orjson.loads(response.content)
         
         if result.get('status') == 'ok':
             servers = result.get('data', {}).get('servers', [])
@@ -84,6 +305,9 @@ def get_best_server():
                 server_name = best_server.get('name')
                 if server_name:
                     print(f"Usando servidor: {server_name}")
+                    with server_cache_lock:
+                        _server_cache['name'] = server_name
+                        _server_cache['expires'] = time.time() + SERVER_CACHE_TTL
                     return server_name
         
         print("No se pudo determinar el mejor servidor, usando store1")
@@ -92,12 +316,12 @@ def get_best_server():
         print(f"Error al obtener servidor de Gofile: {e}")
         return "store1"  # Servidor de respaldo
 
-def upload_to_gofile(local_path, file_path):
+def upload_to_gofile(upload_file, file_path):
     """
     Subir un archivo a Gofile (creando nueva sesión para cada archivo)
     
-    :param local_path: Ruta local del archivo
-    :param file_path: Ruta original del archivo (solo para información)
+    :param upload_file: Archivo abierto que se envía (local o RemoteFile)
+    :param file_path: Ruta original del archivo (para el nombre en Gofile)
     :return: Booleano indicando éxito o fallo
     """
     # Obtener el mejor servidor para la subida
@@ -105,25 +329,32 @@ def upload_to_gofile(local_path, file_path):
     upload_url = f"https://{server}.gofile.io/uploadFile"
     
     try:
-        # Preparar los datos para la subida (SIN folderID para crear uno nuevo cada vez)
-        files = {'file': (os.path.basename(local_path), open(local_path, 'rb'))}
-        
-        # Establecer cabeceras para simular un navegador
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.121 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Origin': 'https://gofile.io',
-            'Referer': 'https://gofile.io/',
-        }
+        # Preparar los datos para la subida (SIN folderID para crear uno nuevo cada vez).
+        # El cuerpo multipart se envía leyendo el archivo por bloques, sin cargarlo en memoria
+        for attempt in range(2):
+            upload_file.seek(0)
+            encoder = MultipartEncoder(fields={
+                'file': (os.path.basename(file_path), upload_file, 'application/octet-stream'),
+            })
+            
+            # Realizar la subida (las cabeceras de navegador ya están en la sesión)
+            print(f"Subiendo archivo a {upload_url}")
+            response = GOFILE_SESSION.post(upload_url, data=encoder, headers={'Content-Type': encoder.content_type})
             
-        # Realizar la subida
-        print(f"Subiendo archivo a {upload_url}")
-        response = requests.post(upload_url, files=files, headers=headers)
+            # Si Gofile limita la tasa de subidas, esperar lo que indique y reintentar una vez
+            if response.status_code == 429 and attempt == 0:
+                try:
+                    wait = int(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    wait = 1  # Retry-After en formato de fecha
+                print(f"Gofile limitó las subidas, reintentando en {wait} segundos...")
+                time.sleep(wait)
+                continue
+            break
         response.raise_for_status()
         
         # Procesar la respuesta
-        result = response.json()
+        result = orjson.loads(response.content)
         
         if result.get('status') == 'ok':
             data = result.get('data', {})
@@ -138,11 +369,7 @@ def upload_to_gofile(local_path, file_path):
                 'download_page': download_page,
                 'guest_token': guest_token
             }
-            successful_uploads.append(upload_info)
-            
-            # Guardar la información en un archivo para referencia futura
-            with open('uploads_info.json', 'w') as f:
-                json.dump(successful_uploads, f, indent=2)
+            record_upload(upload_info)
             
             print(f"Archivo subido correctamente a Gofile: {file_path}")
             print(f"Página de descarga: {download_page}")
@@ -155,10 +382,30 @@ def upload_to_gofile(local_path, file_path):
     except Exception as e:
         print(f"Error al subir el archivo {file_path} a Gofile: {e}")
         return False
-    finally:
-        # Asegurarse de cerrar el archivo
-        if 'files' in locals() and 'file' in files:
-            files['file'][1].close()
+
+def record_upload(upload_info):
+    """
+    Guardar la información de una subida exitosa en memoria y en UPLOADS_INFO_FILE
+    
+    :param upload_info: Diccionario con los datos de la subida
+    """
+    global _uploads_log
+    with uploads_lock:
+        successful_uploads.append(upload_info)
+        
+        # Añadir solo la nueva línea en lugar de reescribir todo el archivo
+        if _uploads_log is None:
+            _uploads_log = open(UPLOADS_INFO_FILE, 'ab')
+        _uploads_log.write(orjson.dumps(upload_info) + b'\n')
+        _uploads_log.flush()
+
+def close_uploads_log():
+    """Cerrar UPLOADS_INFO_FILE si se llegó a abrir"""
+    global _uploads_log
+    with uploads_lock:
+        if _uploads_log is not None:
+            _uploads_log.close()
+            _uploads_log = None
 
 def cleanup(local_path):
     """
@@ -172,6 +419,84 @@ def cleanup(local_path):
     except OSError as e:
         print(f'Error al eliminar el archivo local: {e}')
 
+def transfer(space_name, file_path):
+    """
+    Llevar un archivo de un espacio de Hugging Face a Gofile. Si se conoce su tamaño
+    se sube a medida que se descarga; si no (o con STREAM_UPLOADS desactivado) se
+    guarda en un archivo local para subirlo después
+    
+    :param space_name: Nombre del espacio
+    :param file_path: Ruta del archivo
+    :return: Ruta local pendiente de subir, o None si ya se subió o falló
+    """
+    # URL de descarga
+    download_url = f'https://huggingface.co/spaces/{space_name}/resolve/main/{file_path}?download=true'
+    
+    try:
+        remote = RemoteFile(download_url)
+    except Exception as e:
+        print(f'Error al descargar el archivo {file_path}: {e}')
+        return None
+    
+    try:
+        if STREAM_UPLOADS and remote.size > 0:
+            if not upload_to_gofile(remote, file_path):
+                print(f"No se pudo subir el archivo {file_path}")
+            return None
+        return download_file(remote, file_path)
+    finally:
+        remote.close()
+
+def downloader(pending, total, q):
+    """
+    Transferir archivos pendientes del Space, dejando en la cola los que se
+    hayan tenido que descargar a disco
+    
+    :param pending: Cola con las tuplas (posición, ruta original) por descargar
+    :param total: Número total de archivos (solo para información)
+    :param q: Cola donde se dejan las tuplas (ruta local, ruta original)
+    """
+    while True:
+        try:
+            index, file_path = pending.get_nowait()
+        except queue.Empty:
+            return
+        
+        print(f"\nProcesando archivo {index}/{total}: {file_path}")
+        
+        # Transferir archivo (solo devuelve ruta si queda pendiente de subir)
+        local_path = transfer(SOURCE_SPACE, file_path)
+        if local_path:
+            # Se bloquea mientras la cola esté llena
+            q.put((local_path, file_path))
+
+def uploader(q):
+    """
+    Subir a Gofile los archivos que deja el descargador en la cola
+    
+    :param q: Cola con las tuplas (ruta local, ruta original)
+    """
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        
+        local_path, file_path = item
+        try:
+            with open(local_path, 'rb') as upload_file:
+                # El archivo se lee de principio a fin: pedir más lectura anticipada
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(upload_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                uploaded = upload_to_gofile(upload_file, file_path)
+            
+            if uploaded:
+                # Eliminar archivo local tras subida exitosa
+                cleanup(local_path)
+            else:
+                print(f"No se pudo subir el archivo {file_path}")
+        except Exception as e:
+            print(f"Error procesando {file_path}: {e}")
+
 def main():
     """Función principal para sincronizar archivos de un Space a Gofile"""
     
@@ -186,32 +511,35 @@ def main():
     
     print(f"Se encontraron {len(file_list)} archivos para transferir.")
     
-    # Procesar cada archivo
-    for index, file_path in enumerate(file_list, 1):
-        try:
-            print(f"\nProcesando archivo {index}/{len(file_list)}: {file_path}")
-            
-            # Descargar archivo
-            local_path = download_file(SOURCE_SPACE, file_path)
-            
-            if local_path:
-                # Subir el archivo (sin reintentos)
-                if upload_to_gofile(local_path, file_path):
-                    # Eliminar archivo local tras subida exitosa
-                    cleanup(local_path)
-                else:
-                    print(f"No se pudo subir el archivo {file_path}")
-                
-                # Timeout fijo entre archivos (solo si no es el último)
-                if index < len(file_list):
-                    print(f"Esperando {TIMEOUT_BETWEEN_UPLOADS} segundos antes del próximo archivo...")
-                    time.sleep(TIMEOUT_BETWEEN_UPLOADS)
-        except Exception as e:
-            print(f"Error procesando {file_path}: {e}")
+    pending = queue.Queue()
+    for item in enumerate(file_list, 1):
+        pending.put(item)
+    
+    # Descargar y subir en paralelo: la cola acotada limita los archivos en disco
+    q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    downloaders = [
+        threading.Thread(target=downloader, args=(pending, len(file_list), q), daemon=True)
+        for _ in range(DOWNLOAD_WORKERS)
+    ]
+    uploaders = [
+        threading.Thread(target=uploader, args=(q,), daemon=True)
+        for _ in range(UPLOAD_WORKERS)
+    ]
+    for thread in downloaders + uploaders:
+        thread.start()
+    
+    # Cuando terminen las descargas, avisar a cada subidor de que no quedan archivos
+    for thread in downloaders:
+        thread.join()
+    for _ in uploaders:
+        q.put(None)
+    for thread in uploaders:
+        thread.join()
+    close_uploads_log()
     
     print("\nTransferencia completada.")
     print(f"Se subieron {len(successful_uploads)} archivos correctamente.")
-    print(f"La información de las subidas está disponible en 'uploads_info.json'")
+    print(f"La información de las subidas está disponible en '{UPLOADS_INFO_FILE}'")
 
 if __name__ == '__main__':
     main()